@@ -0,0 +1,33 @@
+/* Optional native implementation of `any_overlap()` from random-small-groups.py.
+ *
+ * The script uses this if it has been compiled to a shared library next to the
+ * script:
+ *     cc -O3 -march=native -shared -fPIC -o any-overlap.so any-overlap.c
+ */
+
+#include <stddef.h>
+#include <stdint.h>
+
+/* Returns 1 if any of the `num_groups` packed groups intersects with any of the
+ * `num_past_groups` packed past groups with intersection size strictly greater
+ * than `max_intersection_size`, and 0 otherwise. Each group is `num_lanes`
+ * consecutive uint64s as packed by `pack_groups()`.
+ */
+int any_overlap(const uint64_t *groups, const uint64_t *past_groups,
+                size_t num_lanes, size_t num_groups, size_t num_past_groups,
+                int64_t max_intersection_size) {
+  for (size_t i = 0; i < num_past_groups; i++) {
+    const uint64_t *past_group = past_groups + i * num_lanes;
+    for (size_t j = 0; j < num_groups; j++) {
+      const uint64_t *group = groups + j * num_lanes;
+      int64_t intersection_size = 0;
+      for (size_t k = 0; k < num_lanes; k++) {
+        intersection_size += __builtin_popcountll(group[k] & past_group[k]);
+      }
+      if (intersection_size > max_intersection_size) {
+        return 1;
+      }
+    }
+  }
+  return 0;
+}
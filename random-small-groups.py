@@ -24,32 +24,86 @@ The above example signals that Alice, Bob, and Erin have been in the same group
 in the past and that Dan, Frank, and Grace have also been in the same group in
 the past. The ability to list past groups in several different files is only for
 organizational convenience---the behavior would be the same if all files in
-"past-groups/" were concatenated together.
+"past-groups/" were concatenated together. Files in "past-groups/" whose names
+start with "." are ignored; the script uses such files to cache the parsed past
+groups between runs.
+
+The script only requires NumPy, but runs faster on large inputs with Numba or
+pyroaring installed. Alternatively, compiling "any-overlap.c" next to this
+script with
+    cc -O3 -march=native -shared -fPIC -o any-overlap.so any-overlap.c
+provides a native version of the overlap check that needs neither.
 """
 
 from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
-from typing import Dict, List, Set
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import (
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+)
 import argparse
+import collections
+import ctypes
+import functools
+import hashlib
+import itertools
+import json
 import math
 import os
+import sys
 
 import numpy as np
 
+try:
+    from pyroaring import BitMap
+except ImportError:
+    # pyroaring is optional; without it large past groups are stored as dense
+    # bitsets.
+    BitMap = None
+
 # Name of file containing email->name mapping.
 EMAIL_TO_NAMES_FILENAME = "names.txt"
 # Directory of files listing past groups.
 PAST_GROUPS_DIRECTORY_PATH = "past-groups"
+# File in the past groups directory caching the parsed past groups. It starts
+# with "." so that it is not read as past groups itself.
+PAST_GROUPS_CACHE_FILENAME = ".cache.json"
+# Version of the format of the past groups cache. Bump this whenever the groups
+# returned by `read_past_groups_file()` change so that old caches are ignored.
+PAST_GROUPS_CACHE_VERSION = 1
+# Shared library compiled from "any-overlap.c", used if it exists next to this
+# script.
+ANY_OVERLAP_LIBRARY_FILENAME = "any-overlap.so"
 
 # Desired group size.
 GROUP_SIZE = 4
 # How many times to attempt to construct a grouping before giving up.
 GROUPING_ATTEMPTS = 1000
+# How many times each attempt may place or move a person before giving up on
+# the attempt.
+MAX_PLACEMENTS_PER_ATTEMPT = 10000
+# How many attempts to run per batch. The shuffles of each batch are generated
+# in one call to NumPy.
+SHUFFLE_BATCH_SIZE = 64
+# Number of worker processes to spread attempts across, or None to use one per
+# CPU. Workers are only started if the first batch of attempts fails.
+NUM_WORKERS = None
 # The max intersection size that any generated group may have with any past
 # group.
 MAX_PAST_GROUP_INTERSECTION = 2
+# The max number of forbidden subsets to index before falling back to comparing
+# groups under construction against the past groups directly.
+MAX_FORBIDDEN_SUBSETS = 1000000
 
 
 def get_email_to_names_table(email_to_names_filename: str) -> Dict[str, str]:
@@ -74,78 +128,616 @@ def get_email_to_names_table(email_to_names_filename: str) -> Dict[str, str]:
     return email_to_names_table
 
 
-def get_past_groups(past_groups_directory_path: str) -> List[Set[str]]:
+def pack_groups(groups: Sequence[Sequence[int]], num_entries: int) -> np.ndarray:
+    """Packs groups of IDs into bitsets.
+
+    Args:
+        groups: Groups of IDs in `0, 1, ..., num_entries - 1`.
+        num_entries: Number of possible IDs.
+
+    Returns:
+        An array of shape `(len(groups), ceil(num_entries / 64))` with dtype
+        uint64 in which bit `i % 64` of entry `(g, i // 64)` is set if ID `i`
+        is in group `g`.
+    """
+    num_lanes = math.ceil(num_entries / 64)
+    packed = np.zeros((len(groups), num_lanes), dtype=np.uint64)
+    group_indices = np.repeat(np.arange(len(groups)), [len(ids) for ids in groups])
+    ids = np.fromiter(itertools.chain.from_iterable(groups), dtype=np.uint64)
+    np.bitwise_or.at(packed, (group_indices, ids >> 6), np.uint64(1) << (ids & 63))
+    return packed
+
+
+def get_past_group_files(past_groups_directory_path: str) -> List[os.DirEntry]:
+    """Returns the files in the past groups directory that list past groups."""
+    return [
+        entry
+        for entry in os.scandir(past_groups_directory_path)
+        if not entry.name.startswith(".") and entry.is_file()
+    ]
+
+
+def read_past_groups_file(
+    path: str, email_bytes_to_id: Dict[bytes, int]
+) -> List[List[int]]:
+    """Returns the nonempty past groups listed in a single file, each given as
+    a sorted list of IDs. Emails not in `email_bytes_to_id` are ignored.
+    """
+    past_groups = []
+    with open(path, "rb") as group_file:
+        for line in group_file.read().split(b"\n"):
+            if not line:
+                continue
+            group = set()
+            for email in line.split():
+                i = email_bytes_to_id.get(email)
+                if i is not None:
+                    group.add(i)
+            if group:
+                past_groups.append(sorted(group))
+    return past_groups
+
+
+def deduplicate_groups(groups: Iterable[List[int]]) -> List[List[int]]:
+    """Returns the distinct groups among sorted groups, in their original
+    order.
+    """
+    return [list(group) for group in dict.fromkeys(tuple(group) for group in groups)]
+
+
+def get_past_groups(
+    past_groups_directory_path: str, email_to_id: Dict[str, int]
+) -> List[List[int]]:
     """Get all past groups of people listed in the input directory."
 
+    Only the files that have changed since the last call are parsed. The parsed
+    groups of each file are cached in the past groups directory along with the
+    file's modification time and size, so adding a file to the directory costs
+    only the parsing of that file.
+
     Args:
         past_groups_directory_path: Path to directory holding files containing
           past groups. Each file in the directory should be text files
           containing past groups, where each group is indicated its own s
           line containing email addresses separated by spaces.
+        email_to_id: A dict mapping each email to a distinct ID in
+          `0, 1, ..., len(email_to_id) - 1`. Emails not in this dict are
+          ignored.
 
     Returns:
-        A list of all past groups.
+        A list of all distinct nonempty past groups, each given as a sorted list
+        of IDs.
     """
-    past_groups = []
-    for entry in os.scandir(past_groups_directory_path):
-        if not entry.name.startswith(".") and entry.is_file:
-            with open(entry.path) as group_file:
-                for line in group_file:
-                    past_groups.append(set(line.split()))
-    return past_groups
+    cache_path = os.path.join(past_groups_directory_path, PAST_GROUPS_CACHE_FILENAME)
+    # IDs are assigned by the order of the emails, so the cache is only valid for
+    # the same list of emails as well as the same cache format.
+    cache_key = hashlib.sha256(
+        json.dumps([PAST_GROUPS_CACHE_VERSION, list(email_to_id)]).encode()
+    ).hexdigest()
+    try:
+        with open(cache_path) as cache_file:
+            cache = json.load(cache_file)
+        cached_files = cache["files"] if cache["key"] == cache_key else {}
+    except (OSError, ValueError, KeyError):
+        cached_files = {}
+
+    # Look up the raw bytes of each email to avoid decoding the files.
+    email_bytes_to_id = {email.encode(): i for email, i in email_to_id.items()}
+    files = {}
+    for entry in get_past_group_files(past_groups_directory_path):
+        stat = entry.stat()
+        cached_file = cached_files.get(entry.name)
+        if (
+            cached_file is not None
+            and cached_file["mtime_ns"] == stat.st_mtime_ns
+            and cached_file["size"] == stat.st_size
+        ):
+            groups = cached_file["groups"]
+        else:
+            groups = read_past_groups_file(entry.path, email_bytes_to_id)
+        files[entry.name] = {
+            "mtime_ns": stat.st_mtime_ns,
+            "size": stat.st_size,
+            "groups": groups,
+        }
+
+    if files != cached_files:
+        # Write to a temporary file first so that an interrupted run cannot
+        # leave a truncated cache behind.
+        with open(cache_path + ".tmp", "w") as cache_file:
+            json.dump({"key": cache_key, "files": files}, cache_file)
+        os.replace(cache_path + ".tmp", cache_path)
+    return deduplicate_groups(
+        group for cached_file in files.values() for group in cached_file["groups"]
+    )
 
 
-def get_random_grouping(entries: List[str], group_size: int) -> List[Set[str]]:
-    """Returns a random grouping of the input list with each groups being
-    of size approximately `group_size`.
+def get_forbidden_subsets(
+    past_groups: List[List[int]], subset_size: int, max_num_subsets: int
+) -> Optional[Set[Tuple[int, ...]]]:
+    """Returns every subset of size `subset_size` of every past group.
+
+    A generated group intersects a past group in more than `subset_size - 1`
+    people exactly when it contains one of these subsets, so checking a group
+    only requires looking up each of its own subsets of size `subset_size`.
 
     Args:
-        entries: List of entries to be grouped.
-        group_size: The desired size of each group.
+        past_groups: Past groups, each given as a sorted list of IDs.
+        subset_size: Size of the subsets to enumerate.
+        max_num_subsets: Limit on the number of subsets to enumerate. Large
+          past groups have many subsets, so the index may be too big to build.
 
     Returns:
-        A random partition of the input entries with each group in the partition
-        being of size `group_size` or `group_size - 1`.
+        A set of the subsets, each given as a sorted tuple of IDs, or None if
+        there are more than `max_num_subsets` subsets.
+    """
+    num_subsets = sum(math.comb(len(group), subset_size) for group in past_groups)
+    if num_subsets > max_num_subsets:
+        return None
+    return {
+        subset
+        for group in past_groups
+        for subset in itertools.combinations(group, subset_size)
+    }
+
+
+def load_native_any_overlap() -> Optional[Callable[..., bool]]:
+    """Returns `numpy_any_overlap()` as implemented by the C library in
+    any-overlap.c if it has been built next to this script and can be loaded,
+    and None otherwise.
     """
+    library_path = os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), ANY_OVERLAP_LIBRARY_FILENAME
+    )
+    if not os.path.exists(library_path):
+        return None
+    try:
+        library = ctypes.CDLL(library_path)
+    except OSError:
+        # The library may have been built for another platform.
+        return None
+    packed_groups_type = np.ctypeslib.ndpointer(
+        dtype=np.uint64, ndim=2, flags="C_CONTIGUOUS"
+    )
+    library.any_overlap.argtypes = [
+        packed_groups_type,
+        packed_groups_type,
+        ctypes.c_size_t,
+        ctypes.c_size_t,
+        ctypes.c_size_t,
+        ctypes.c_int64,
+    ]
+    library.any_overlap.restype = ctypes.c_int
+
+    def any_overlap(
+        groups: np.ndarray, past_groups: np.ndarray, max_intersection_size: int
+    ) -> bool:
+        num_groups, num_lanes = groups.shape
+        return bool(
+            library.any_overlap(
+                groups,
+                past_groups,
+                num_lanes,
+                num_groups,
+                past_groups.shape[0],
+                max_intersection_size,
+            )
+        )
 
-    num_groups = math.ceil(len(entries) / group_size)
-    permuted_entries = np.random.permutation(entries)
-    return [set(group) for group in np.array_split(permuted_entries, num_groups)]
+    return any_overlap
 
 
-def grouping_is_valid(
-    proposed_grouping: List[Set[str]],
-    past_groups: List[Set[str]],
-    max_intersection_size: int,
+def popcount64(typingctx, x):
+    """Returns the number of set bits in a uint64 via LLVM's ctpop intrinsic,
+    which compiles to a single POPCNT instruction where available.
+
+    The count is returned as an int64 so that summing counts into an int does
+    not mix signed and unsigned types, which Numba widens to float64. This is
+    replaced with a Numba intrinsic by `compile_numba_any_overlap()`.
+    """
+    from numba import types
+
+    sig = types.int64(types.uint64)
+
+    def codegen(context, builder, signature, args):
+        return builder.ctpop(args[0])
+
+    return sig, codegen
+
+
+def numba_any_overlap(
+    groups: np.ndarray, past_groups: np.ndarray, max_intersection_size: int
 ) -> bool:
-    """Returns true if no group in the proposed grouping intersects with any
-    past group with intersection size strictly greater than
+    """Same as `numpy_any_overlap()`, but written as loops for Numba to compile
+    with `compile_numba_any_overlap()`.
+    """
+    for i in range(past_groups.shape[0]):
+        for j in range(groups.shape[0]):
+            intersection_size = 0
+            for k in range(past_groups.shape[1]):
+                intersection_size += popcount64(groups[j, k] & past_groups[i, k])
+            if intersection_size > max_intersection_size:
+                return True
+    return False
+
+
+@functools.lru_cache(maxsize=None)
+def compile_numba_any_overlap() -> Optional[Callable[..., bool]]:
+    """Returns `numba_any_overlap()` compiled with Numba, or None if Numba is
+    not installed.
+
+    Numba is imported here rather than at the top of the script since importing
+    it takes longer than most runs spend checking overlaps.
+    """
+    global popcount64
+    try:
+        from numba import njit
+        from numba.extending import intrinsic
+    except ImportError:
+        return None
+    popcount64 = intrinsic(popcount64)
+    return njit(cache=True, boundscheck=False)(numba_any_overlap)
+
+
+# Number of set bits in each possible byte.
+BYTE_POPCOUNTS = np.array([bin(byte).count("1") for byte in range(256)])
+
+
+def popcount(x: np.ndarray) -> np.ndarray:
+    """Returns the number of set bits in each element of a uint64 array."""
+    if hasattr(np, "bitwise_count"):  # NumPy >= 2.0
+        return np.bitwise_count(x)
+    return BYTE_POPCOUNTS[x.view(np.uint8)].reshape(x.shape + (8,)).sum(axis=-1)
+
+
+def numpy_any_overlap(
+    groups: np.ndarray, past_groups: np.ndarray, max_intersection_size: int
+) -> bool:
+    """Returns true if any of the packed groups intersects with any of the
+    packed past groups with intersection size strictly greater than
     `max_intersection_size`.
     """
-    for group in proposed_grouping:
+    intersections = groups[:, np.newaxis, :] & past_groups[np.newaxis, :, :]
+    intersection_sizes = popcount(intersections).sum(axis=2)
+    return bool(np.any(intersection_sizes > max_intersection_size))
+
+
+def get_any_overlap() -> Callable[..., bool]:
+    """Returns the fastest available implementation of `numpy_any_overlap()`:
+    the compiled C library if it has been built, then Numba if it is installed,
+    then plain NumPy.
+    """
+    return load_native_any_overlap() or compile_numba_any_overlap() or numpy_any_overlap
+
+
+def get_placement_validator(
+    past_groups: List[List[int]], num_entries: int, max_intersection_size: int
+) -> Callable[[List[int], int], bool]:
+    """Returns a function `can_add(group, id)` that returns true if adding `id`
+    to `group` keeps the group from intersecting any past group with
+    intersection size strictly greater than `max_intersection_size`.
+
+    `group` must not already violate this condition. The function looks up the
+    forbidden subsets that adding `id` would complete if there are few enough
+    of them to index. Otherwise it compares the group against the past groups
+    containing `id` as roaring bitmaps if pyroaring is installed, or against
+    every past group as dense bitsets if not.
+    """
+    # Past groups this small can never intersect a generated group too much.
+    past_groups = [group for group in past_groups if len(group) > max_intersection_size]
+
+    forbidden_subsets = get_forbidden_subsets(
+        past_groups,
+        subset_size=max_intersection_size + 1,
+        max_num_subsets=MAX_FORBIDDEN_SUBSETS,
+    )
+    if forbidden_subsets is not None:
+        # `past_groupmates[i]` holds the IDs sharing some past group with ID `i`.
+        past_groupmates: List[Set[int]] = [set() for _ in range(num_entries)]
+        for past_group in past_groups:
+            for i in past_group:
+                past_groupmates[i].update(past_group)
+        # `can_add` is called for every candidate placement, so bind this to a
+        # local name instead of looking it up in the module each call.
+        combinations = itertools.combinations
+
+        def can_add(group: List[int], new_id: int) -> bool:
+            # Only subsets containing `new_id` are new, since `group` is valid,
+            # and those can only be forbidden if the rest of the subset are
+            # past groupmates of `new_id`.
+            new_id_groupmates = past_groupmates[new_id]
+            groupmates = [i for i in group if i in new_id_groupmates]
+            for subset in combinations(groupmates, max_intersection_size):
+                if tuple(sorted(subset + (new_id,))) in forbidden_subsets:
+                    return False
+            return True
+
+        return can_add
+
+    if BitMap is not None:
+        # `past_groups_of[i]` holds the past groups containing ID `i`.
+        past_groups_of: List[List[BitMap]] = [[] for _ in range(num_entries)]
         for past_group in past_groups:
-            if len(group & past_group) > max_intersection_size:
-                return False
-    return True
+            past_group_bitmap = BitMap(past_group)
+            for i in past_group:
+                past_groups_of[i].append(past_group_bitmap)
+
+        # Holds the bitmap of the last group passed to `can_add`, since
+        # candidates are tried one after another against the same group.
+        group_bitmaps: Dict[Tuple[int, ...], BitMap] = {}
+
+        def can_add(group: List[int], new_id: int) -> bool:
+            group_key = tuple(group)
+            group_bitmap = group_bitmaps.get(group_key)
+            if group_bitmap is None:
+                group_bitmaps.clear()
+                group_bitmap = group_bitmaps[group_key] = BitMap(group)
+            # Only past groups containing `new_id` can newly intersect the group
+            # too much, since `group` is valid.
+            return all(
+                group_bitmap.intersection_cardinality(past_group)
+                < max_intersection_size
+                for past_group in past_groups_of[new_id]
+            )
+
+        return can_add
+
+    packed_past_groups = pack_groups(past_groups, num_entries)
+    any_overlap = get_any_overlap()
+    id_bits = np.uint64(1) << np.arange(64, dtype=np.uint64)
+    # Holds the packed form of the last group passed to `can_add`, since
+    # candidates are tried one after another against the same group.
+    packed_groups: Dict[Tuple[int, ...], np.ndarray] = {}
+
+    def can_add(group: List[int], new_id: int) -> bool:
+        group_key = tuple(group)
+        packed_group = packed_groups.get(group_key)
+        if packed_group is None:
+            packed_groups.clear()
+            packed_group = packed_groups[group_key] = pack_groups([group], num_entries)
+        # Only the lane holding `new_id` changes, so set its bit in place and
+        # restore the lane afterwards.
+        lane = new_id >> 6
+        group_lane = packed_group[0, lane]
+        packed_group[0, lane] = group_lane | id_bits[new_id & 63]
+        overlaps = any_overlap(packed_group, packed_past_groups, max_intersection_size)
+        packed_group[0, lane] = group_lane
+        return not overlaps
+
+    return can_add
+
+
+def get_shuffle_batches(
+    rng: np.random.Generator, num_entries: int, batch_size: int, num_shuffles: int
+) -> Iterator[np.ndarray]:
+    """Yields `num_shuffles` random permutations of the IDs
+    `0, 1, ..., num_entries - 1` as the rows of arrays of up to `batch_size`
+    rows.
+    """
+    for batch_start in range(0, num_shuffles, batch_size):
+        num_rows = min(batch_size, num_shuffles - batch_start)
+        yield rng.permuted(np.tile(np.arange(num_entries), (num_rows, 1)), axis=1)
+
+
+def get_group_capacities(num_entries: int, group_size: int) -> List[int]:
+    """Returns the sizes of the groups in a grouping of `num_entries` entries
+    with each group being of size `group_size` or `group_size - 1`.
+
+    The sizes match those of `np.array_split()`.
+    """
+    num_groups = -(-num_entries // group_size)
+    small_size, num_large_groups = divmod(num_entries, num_groups)
+    return [small_size + 1] * num_large_groups + [small_size] * (
+        num_groups - num_large_groups
+    )
+
+
+def build_grouping(
+    order: np.ndarray,
+    capacities: List[int],
+    can_add: Callable[[List[int], int], bool],
+    max_placements: int,
+) -> Optional[List[List[int]]]:
+    """Returns a grouping of the IDs `0, 1, ..., len(order) - 1` into groups of
+    the given sizes, such that every group could be built up one ID at a time
+    with `can_add`.
+
+    The groups are filled one at a time. Each group starts with the earliest
+    unassigned ID in the given order, and its remaining members are the next
+    IDs in that order that `can_add` accepts. When a group cannot be completed,
+    the search backtracks and replaces the most recently added member with a
+    later ID, or, if that member started its group, retries the group with a
+    smaller size. Fixing each group's first member and adding members in order
+    means that every grouping can be built in only one way, so the search never
+    revisits a grouping that differs only by relabeling groups or reordering
+    members.
+
+    Args:
+        order: A permutation of the IDs giving the order in which to place them.
+          Shuffling it randomizes the grouping.
+        capacities: Sizes of the groups, as returned by `get_group_capacities()`.
+        can_add: Function returned by `get_placement_validator()`.
+        max_placements: How many times an ID may be placed or replaced before
+          the search gives up.
+
+    Returns:
+        A partition of the entry IDs into groups with sizes `capacities` (though
+        not necessarily in that order), or None if the search gave up.
+    """
+    num_entries = len(order)
+    order = order.tolist()
+    groups: List[List[int]] = [[] for _ in capacities]
+    # Sizes of the started groups and the number of unstarted groups per size.
+    group_sizes: List[int] = []
+    num_unstarted = collections.Counter(capacities)
+    # Upper bound on the size of the next group to start.
+    largest_size = max(capacities)
+    max_size = largest_size
+    is_assigned = [False] * num_entries
+    # Positions in `order` of the assigned IDs, in the order they were assigned.
+    assigned_positions = []
+    # Index of the group being filled.
+    g = 0
+    # Position in `order` at which to look for the next member of group `g`.
+    start = 0
+    for _ in range(max_placements):
+        if g == len(groups):
+            return groups
+        group = groups[g]
+        pos = None
+        if group:
+            for candidate in range(start, num_entries):
+                if not is_assigned[candidate] and can_add(group, order[candidate]):
+                    pos = candidate
+                    break
+        else:
+            sizes = [
+                size
+                for size, count in num_unstarted.items()
+                if count > 0 and size <= max_size
+            ]
+            first = is_assigned.index(False)
+            if sizes and can_add(group, order[first]):
+                pos = first
+                group_sizes.append(max(sizes))
+                num_unstarted[max(sizes)] -= 1
+                max_size = largest_size
+        if pos is not None:
+            group.append(order[pos])
+            is_assigned[pos] = True
+            assigned_positions.append(pos)
+            start = pos + 1
+            if len(group) == group_sizes[g]:
+                g += 1
+            continue
+
+        # Backtrack by removing the most recently added member.
+        if not assigned_positions:
+            return None
+        if not group:
+            g -= 1
+        pos = assigned_positions.pop()
+        groups[g].pop()
+        is_assigned[pos] = False
+        if groups[g]:
+            start = pos + 1
+            max_size = largest_size
+        else:
+            # The removed member started its group, so it stays the first member
+            # but of a smaller group.
+            size = group_sizes.pop()
+            num_unstarted[size] += 1
+            max_size = size - 1
+    return groups if g == len(groups) else None
+
+
+# Placement validator of a worker process, set by `init_worker()`.
+worker_can_add: Optional[Callable[[List[int], int], bool]] = None
+
+
+def init_worker(
+    past_groups: List[List[int]], num_entries: int, max_intersection_size: int
+) -> None:
+    """Builds the placement validator used by `try_shuffles()` in a worker
+    process. The validator is a closure and so cannot be sent to the worker.
+    """
+    global worker_can_add
+    worker_can_add = get_placement_validator(
+        past_groups, num_entries, max_intersection_size
+    )
+
+
+def try_shuffles(
+    shuffles: np.ndarray,
+    capacities: List[int],
+    max_placements: int,
+    can_add: Optional[Callable[[List[int], int], bool]] = None,
+) -> Tuple[int, Optional[List[List[int]]]]:
+    """Calls `build_grouping()` with each row of `shuffles` as the order until
+    it finds a grouping.
+
+    Args:
+        shuffles: Array whose rows are permutations of the IDs.
+        capacities: Sizes of the groups, as returned by
+          `get_group_capacities()`.
+        max_placements: Placement budget of each call to `build_grouping()`.
+        can_add: Function returned by `get_placement_validator()`. Defaults to
+          the one built by `init_worker()`.
+
+    Returns:
+        The number of attempts made and the grouping found, or None if every
+        attempt failed.
+    """
+    if can_add is None:
+        can_add = worker_can_add
+    for attempt, order in enumerate(shuffles, start=1):
+        grouping = build_grouping(order, capacities, can_add, max_placements)
+        if grouping is not None:
+            return attempt, grouping
+    return len(shuffles), None
+
+
+def try_shuffles_in_parallel(
+    shuffle_batches: Iterator[np.ndarray],
+    past_groups: List[List[int]],
+    capacities: List[int],
+    max_intersection_size: int,
+    max_placements: int,
+    num_workers: Optional[int],
+) -> Tuple[int, Optional[List[List[int]]]]:
+    """Same as `try_shuffles()`, but spreads the shuffles across worker
+    processes and returns the first grouping any of them finds.
+
+    The returned number of attempts counts the attempts submitted before the
+    successful one, whether or not they finished. Each attempt is submitted
+    separately so that once a grouping is found, only the attempts that workers
+    have already picked up are waited on: about two per worker, each bounded
+    by `max_placements`.
+    """
+    num_entries = sum(capacities)
+    with ProcessPoolExecutor(
+        max_workers=num_workers,
+        initializer=init_worker,
+        initargs=(past_groups, num_entries, max_intersection_size),
+    ) as executor:
+        # Maps each attempt's future to the number of attempts before it.
+        futures = {}
+        num_attempts = 0
+        for shuffles in shuffle_batches:
+            for order in shuffles:
+                future = executor.submit(
+                    try_shuffles, order[np.newaxis], capacities, max_placements
+                )
+                futures[future] = num_attempts
+                num_attempts += 1
+        for future in as_completed(futures):
+            attempt, grouping = future.result()
+            if grouping is not None:
+                executor.shutdown(cancel_futures=True)
+                return futures[future] + attempt, grouping
+    return num_attempts, None
 
 
 def print_grouping(
-    grouping: List[Set[str]], email_to_names: Dict[str, str], output_filename: str
+    grouping: List[List[int]],
+    id_to_email: List[str],
+    email_to_names: Dict[str, str],
+    output_filename: str,
 ) -> None:
     """Prints the emails and names given by the input grouping and writes the
     emails to the given output file.
     """
-    for group in grouping:
-        print(" ".join(group))
-        names = [email_to_names[email] for email in group]
+    email_lines = [" ".join(id_to_email[i] for i in group) for group in grouping]
+    printed_lines = []
+    for group, email_line in zip(grouping, email_lines):
+        names = [email_to_names[id_to_email[i]] for i in group]
         # Print out names in the format of an email greeting.
         greeting = "Hi " + (", ".join(names[:-1])) + ", and " + names[-1] + ","
-        print(greeting)
-        print()
+        printed_lines += [email_line, greeting, ""]
+    sys.stdout.write("".join(line + "\n" for line in printed_lines))
 
     with open(output_filename, "w") as output_file:
-        for group in grouping:
-            output_file.write(" ".join(group) + "\n")
+        output_file.write("".join(line + "\n" for line in email_lines))
 
 
 def main() -> None:
@@ -161,22 +753,48 @@ def main() -> None:
     output_filename = PAST_GROUPS_DIRECTORY_PATH + "/" + args.output_file
 
     email_to_names = get_email_to_names_table(EMAIL_TO_NAMES_FILENAME)
-    past_groups = get_past_groups(PAST_GROUPS_DIRECTORY_PATH)
     emails = list(email_to_names.keys())
-    for attempt in range(1, GROUPING_ATTEMPTS + 1):
-        grouping = get_random_grouping(entries=emails, group_size=GROUP_SIZE)
-        if grouping_is_valid(
-            proposed_grouping=grouping,
+    email_to_id = {email: i for i, email in enumerate(emails)}
+    past_groups = get_past_groups(PAST_GROUPS_DIRECTORY_PATH, email_to_id)
+    can_add = get_placement_validator(
+        past_groups=past_groups,
+        num_entries=len(emails),
+        max_intersection_size=MAX_PAST_GROUP_INTERSECTION,
+    )
+    capacities = get_group_capacities(num_entries=len(emails), group_size=GROUP_SIZE)
+    shuffle_batches = get_shuffle_batches(
+        rng=np.random.default_rng(),
+        num_entries=len(emails),
+        batch_size=SHUFFLE_BATCH_SIZE,
+        num_shuffles=GROUPING_ATTEMPTS,
+    )
+    # Most inputs succeed within a few attempts, so try the first batch here
+    # before paying to start worker processes.
+    num_attempts, grouping = try_shuffles(
+        shuffles=next(shuffle_batches),
+        capacities=capacities,
+        max_placements=MAX_PLACEMENTS_PER_ATTEMPT,
+        can_add=can_add,
+    )
+    if grouping is None:
+        num_parallel_attempts, grouping = try_shuffles_in_parallel(
+            shuffle_batches=shuffle_batches,
             past_groups=past_groups,
+            capacities=capacities,
             max_intersection_size=MAX_PAST_GROUP_INTERSECTION,
-        ):
-            print(f"Found groups in {attempt} attempts.\n")
-            print_grouping(
-                grouping=grouping,
-                email_to_names=email_to_names,
-                output_filename=output_filename,
-            )
-            return
+            max_placements=MAX_PLACEMENTS_PER_ATTEMPT,
+            num_workers=NUM_WORKERS,
+        )
+        num_attempts += num_parallel_attempts
+    if grouping is not None:
+        print(f"Found groups in {num_attempts} attempts.\n")
+        print_grouping(
+            grouping=grouping,
+            id_to_email=emails,
+            email_to_names=email_to_names,
+            output_filename=output_filename,
+        )
+        return
     print(
         f"Failed to find groups in {GROUPING_ATTEMPTS} attempts. "
         "Try again or prune the list of past groups."